@@ -1,10 +1,8 @@
 import sys
 from pathlib import Path
-from typing import Dict, List, Any, Annotated, Callable, cast
-from langchain_core.messages import HumanMessage
+from typing import List, Callable
 from langgraph.graph import StateGraph, END, START
 from langgraph.graph.graph import CompiledGraph
-from langgraph.pregel import Pregel
 
 sys.path.append(str(Path(__file__).parent))
 
@@ -53,8 +51,9 @@ def create_expert_group_graph(group_name: str, expert_nodes: List[Callable], sum
     Returns:
         Đồ thị đã biên dịch cho nhóm chuyên gia
     """
-    # Create workflow for the group
-    workflow = StateGraph(AgentState)
+    # Create workflow for the group; only group results are written back to the parent
+    # graph so groups running in parallel do not collide on the input keys
+    workflow = StateGraph(AgentState, output=OutputState)
     
     # Add all expert nodes
     expert_names = [f"expert_{i}" for i in range(len(expert_nodes))]
@@ -67,15 +66,12 @@ def create_expert_group_graph(group_name: str, expert_nodes: List[Callable], sum
     
     # Connect the nodes
     if expert_names:
-        # Connect START to first expert
-        workflow.add_edge(START, expert_names[0])
+        # Experts are independent of each other, so fan out from START in parallel
+        for expert_name in expert_names:
+            workflow.add_edge(START, expert_name)
         
-        # Connect experts sequentially
-        for i in range(len(expert_names) - 1):
-            workflow.add_edge(expert_names[i], expert_names[i + 1])
-        
-        # Connect last expert to summarizer
-        workflow.add_edge(expert_names[-1], summarizer_name)
+        # Join all experts at the summarizer
+        workflow.add_edge(expert_names, summarizer_name)
     else:
         # If no experts, connect START directly to summarizer
         workflow.add_edge(START, summarizer_name)
@@ -134,7 +130,7 @@ strategy_group_graph = create_expert_group_graph(
 
 def create_main_graph() -> CompiledGraph:
     """
-    Tạo đồ thị chính để điều phối tất cả các nhóm chuyên gia theo tuần tự.
+    Tạo đồ thị chính để điều phối tất cả các nhóm chuyên gia song song.
     
     Returns:
         Đồ thị chính đã biên dịch
@@ -152,15 +148,16 @@ def create_main_graph() -> CompiledGraph:
     # Add final synthesizer node
     main_workflow.add_node("final_synthesis", final_synthesizer)
     
-    # Connect the nodes sequentially, not in parallel
-    # Connect START directly to the first group
-    main_workflow.add_edge(START, "market_analysis_group")
+    # Run the four analysis groups in parallel from START
+    analysis_groups = [
+        "market_analysis_group", "financial_analysis_group",
+        "sectoral_analysis_group", "external_factors_group"
+    ]
+    for group in analysis_groups:
+        main_workflow.add_edge(START, group)
 
-    # Connect in sequence: market -> financial -> sectoral -> external -> strategy -> final_synthesis
-    main_workflow.add_edge("market_analysis_group", "financial_analysis_group")
-    main_workflow.add_edge("financial_analysis_group", "sectoral_analysis_group")
-    main_workflow.add_edge("sectoral_analysis_group", "external_factors_group")
-    main_workflow.add_edge("external_factors_group", "strategy_group")
+    # Join the analysis groups before strategy, then synthesize
+    main_workflow.add_edge(analysis_groups, "strategy_group")
     main_workflow.add_edge("strategy_group", "final_synthesis")
     main_workflow.add_edge("final_synthesis", END)
     
@@ -1,12 +1,24 @@
-from typing import Dict, List, Any, Annotated, TypedDict, cast, Optional
+from typing import Dict, List, Any, Annotated, TypedDict, Optional, Tuple, Sequence, Type
 import os
 import sys
 import json
+import asyncio
+import hashlib
+import time
+import itertools
+import weakref
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
+import httpx
+import aiofiles
+import openai
 
 from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langgraph.types import StreamWriter
 from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field, field_validator
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
@@ -33,122 +45,228 @@ from experts.group_5 import (
     ASSET_ALLOCATION_STRATEGIST, INVESTMENT_PSYCHOLOGY_EXPERT
 )
 
-from agents.tools import simple_search
+from agents.tools import asimple_search
+from agents.rate_limiter import LLMRateLimiter, estimate_tokens
 
-# Load environment variables
-load_dotenv()
+def merge_dicts(left: Dict, right: Dict) -> Dict:
+    """Gộp hai dict trong state, dùng làm reducer cho các node chạy song song."""
+    return {**(left or {}), **(right or {})}
 
 # Define state structure with output_folder
 class InputState(TypedDict):
-    question: Annotated[str, "merge"]  # User question or goal
-    output_folder: Annotated[str, "merge"]  # Output folder name
+    question: str  # User question or goal, written once by the caller and read by every node
+    output_folder: str  # Output folder name
 
 class OutputState(TypedDict):
-    group_1: Annotated[Dict[str, str], "merge"]   # Analyses from group 1 - Market Analysis
-    group_2: Annotated[Dict[str, str], "merge"]   # Analyses from group 2 - Financial Analysis
-    group_3: Annotated[Dict[str, str], "merge"]   # Analyses from group 3 - Sectoral Analysis
-    group_4: Annotated[Dict[str, str], "merge"]   # Analyses from group 4 - External Factors
-    group_5: Annotated[Dict[str, str], "merge"]   # Analyses from group 5 - Strategy
-    group_summaries: Annotated[Dict[str, str], "merge"]  # Summaries from each group
+    group_1: Annotated[Dict[str, str], merge_dicts]   # Analyses from group 1 - Market Analysis
+    group_2: Annotated[Dict[str, str], merge_dicts]   # Analyses from group 2 - Financial Analysis
+    group_3: Annotated[Dict[str, str], merge_dicts]   # Analyses from group 3 - Sectoral Analysis
+    group_4: Annotated[Dict[str, str], merge_dicts]   # Analyses from group 4 - External Factors
+    group_5: Annotated[Dict[str, str], merge_dicts]   # Analyses from group 5 - Strategy
+    group_summaries: Annotated[Dict[str, str], merge_dicts]  # Summaries from each group
     final_report: str                # Final synthesis report
-    search_results: Annotated[Dict[str, Dict[str, Any]], "merge"]  # Search results
+    search_results: Annotated[Dict[str, Dict[str, Any]], merge_dicts]  # Search results
 
 class AgentState(InputState, OutputState):
     """Combined state for the agent system, inheriting from both input and output states."""
     pass
 
+MODEL_NAME = "gpt-4o-mini"  # Model for expert analysis, group summaries and final synthesis
+QUERY_MODEL_NAME = "gpt-4.1-nano"  # Default smaller model for planning search queries
+
+@lru_cache(maxsize=1)
+def load_environment() -> None:
+    """Nạp biến môi trường từ tệp .env một lần, khi cấu hình được đọc lần đầu."""
+    load_dotenv()
+
+# httpx.AsyncClient (and the ChatOpenAI clients built on it) is bound to the event loop it first runs on,
+# so each running loop gets its own connection pool and clients
+loop_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+loop_chat_models: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Tuple[ChatOpenAI, ...]]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+def get_http_client() -> httpx.AsyncClient:
+    """Lấy (tạo nếu chưa có) connection pool HTTP dùng chung cho mọi mô hình trong event loop đang chạy."""
+    loop = asyncio.get_running_loop()
+    client = loop_http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=64, max_connections=128)
+        )
+        loop_http_clients[loop] = client
+    return client
+
+@lru_cache(maxsize=1)
+def get_api_keys() -> Tuple[str, ...]:
+    """
+    Đọc một lần các khóa API OpenAI: OPENAI_API_KEYS (phân tách bằng dấu phẩy) hoặc OPENAI_API_KEY.
+    Các node trong cùng một lần chạy luôn thấy cùng một cấu hình, kể cả khi môi trường thay đổi.
+    """
+    load_environment()
+    api_keys = tuple(key.strip() for key in os.getenv("OPENAI_API_KEYS", "").split(",") if key.strip())
+    if not api_keys:
+        api_key = os.getenv("OPENAI_API_KEY")
+        api_keys = (api_key,) if api_key else ()
+    
+    if not api_keys:
+        raise ValueError("Không tìm thấy khóa API cho OpenAI")
+    return api_keys
+
+def create_chat_models(model_name: str) -> Tuple[ChatOpenAI, ...]:
+    """
+    Tạo (một lần cho mỗi tên mô hình trong mỗi event loop) một client ChatOpenAI cho mỗi khóa API,
+    dùng chung connection pool.
+    """
+    models = loop_chat_models.setdefault(asyncio.get_running_loop(), {})
+    if model_name not in models:
+        models[model_name] = tuple(
+            ChatOpenAI(
+                model=model_name,
+                temperature=0,
+                api_key=api_key,
+                http_async_client=get_http_client()
+            )
+            for api_key in get_api_keys()
+        )
+    return models[model_name]
+
+KEY_FAILOVER_ERRORS = (openai.RateLimitError, openai.AuthenticationError)  # Errors that move a call on to the next API key
+key_rotation = itertools.count()  # Picks which API key is primary for each model handed out
+
+def with_key_failover(runnables: Sequence[Runnable]) -> Runnable:
+    """
+    Ghép các runnable (mỗi khóa API một runnable): khóa chính xoay vòng qua mỗi lần gọi để phân tải,
+    các khóa còn lại làm dự phòng khi khóa chính bị giới hạn tốc độ hoặc bị từ chối xác thực.
+    """
+    start = next(key_rotation) % len(runnables)
+    primary, *fallbacks = list(runnables[start:]) + list(runnables[:start])
+    if not fallbacks:
+        return primary
+    return primary.with_fallbacks(fallbacks, exceptions_to_handle=KEY_FAILOVER_ERRORS)
+
 def get_model():
     """
     Lấy mô hình LLM phù hợp dựa trên cấu hình môi trường.
-    Trả về mô hình OpenAI theo mặc định.
+    Trả về mô hình OpenAI theo mặc định; với nhiều khóa API, các khóa luân phiên làm khóa chính và dự phòng cho nhau.
     """
-    if os.getenv("OPENAI_API_KEY"):
-        return ChatOpenAI(model="gpt-4o-mini", temperature=0, api_key=os.getenv("OPENAI_API_KEY"))
-    else:
-        raise ValueError("Không tìm thấy khóa API cho OpenAI")
+    return with_key_failover(create_chat_models(MODEL_NAME))
+
+@lru_cache(maxsize=1)
+def get_query_model_name() -> str:
+    """Tên mô hình nhỏ cho bước lập truy vấn, có thể thay đổi qua biến môi trường OPENAI_QUERY_MODEL."""
+    load_environment()
+    return os.getenv("OPENAI_QUERY_MODEL", QUERY_MODEL_NAME)
+
+def get_small_model(schema: Optional[Type[BaseModel]] = None):
+    """
+    Lấy mô hình nhỏ, nhanh hơn cho bước lập truy vấn tìm kiếm.
+    Nếu có schema, trả về kết quả có cấu trúc theo schema đó.
+    """
+    models = create_chat_models(get_query_model_name())
+    if schema is not None:
+        # Bind the structured output on each client before chaining the fallbacks;
+        # strict JSON schema mode guarantees a parsable result, so no fallback parsing is needed
+        models = tuple(model.with_structured_output(schema, method="json_schema", strict=True) for model in models)
+    return with_key_failover(models)
+
+@lru_cache(maxsize=1)
+def get_rate_limiter() -> LLMRateLimiter:
+    """Bộ giới hạn dùng chung cho mọi lời gọi LLM để các node song song không vượt giới hạn của OpenAI."""
+    load_environment()
+    return LLMRateLimiter(
+        max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+        rpm=int(os.getenv("OPENAI_RPM", "500")),
+        tpm=int(os.getenv("OPENAI_TPM", "200000"))
+    )
+
+async def ainvoke_llm(llm, messages):
+    """Gọi LLM thông qua bộ giới hạn tốc độ dùng chung."""
+    async with get_rate_limiter().acquire(estimate_tokens(messages)):
+        return await llm.ainvoke(messages)
 
-def generate_search_queries(llm, system_prompt, question, expert_name):
+async def astream_llm(llm, messages, writer: StreamWriter, config: Optional[RunnableConfig] = None) -> str:
+    """
+    Stream lời gọi LLM qua bộ giới hạn tốc độ dùng chung, đẩy từng token ra custom stream của đồ thị.
+    Trả về toàn bộ nội dung phản hồi.
+    """
+    parts = []
+    async with get_rate_limiter().acquire(estimate_tokens(messages)):
+        async for chunk in llm.astream(messages, config):
+            if chunk.content:
+                writer({"final_report_token": chunk.content})
+                parts.append(chunk.content)
+    return "".join(parts)
+
+MAX_SEARCH_QUERIES = 5  # Maximum number of search queries per expert
+
+class SearchQueries(BaseModel):
+    """Các truy vấn tìm kiếm do mô hình nhỏ lập cho một chuyên gia."""
+    queries: List[str] = Field(description="3-5 truy vấn tìm kiếm cụ thể về thị trường Việt Nam")
+
+    @field_validator("queries")
+    @classmethod
+    def clean_queries(cls, queries: List[str]) -> List[str]:
+        """Bỏ các truy vấn rỗng hoặc trùng lặp và giới hạn số lượng truy vấn."""
+        cleaned = list(dict.fromkeys(query.strip() for query in queries if query.strip()))
+        return cleaned[:MAX_SEARCH_QUERIES]
+
+async def generate_search_queries(llm, system_prompt, question, expert_name) -> List[str]:
     """Tạo các truy vấn tìm kiếm dựa trên lĩnh vực chuyên gia và câu hỏi."""
-    query_generation_prompt = f"""
+    planning_prompt = f"""
     {system_prompt}
     
-    Nhiệm vụ của bạn là tạo 3-5 truy vấn tìm kiếm cụ thể sẽ giúp thu thập thông tin để trả lời câu hỏi sau từ góc độ chuyên gia của bạn:
+    Nhiệm vụ của bạn là tạo các truy vấn tìm kiếm để trả lời câu hỏi sau từ góc độ chuyên gia của bạn:
     
     CÂU HỎI: {question}
     
     HƯỚNG DẪN:
     1. Xem xét những thông tin bạn cần với tư cách là một {expert_name} để trả lời câu hỏi này một cách đúng đắn
-    2. Tạo các truy vấn tìm kiếm sẽ tìm thông tin liên quan, hiện tại về thị trường Việt Nam
+    2. Tạo 3-5 truy vấn tìm kiếm sẽ tìm thông tin liên quan, hiện tại về thị trường Việt Nam
     3. Làm cho các truy vấn của bạn cụ thể và tập trung
-    4. Định dạng phản hồi của bạn dưới dạng danh sách JSON các chuỗi chỉ chứa các truy vấn
-    
-    Ví dụ định dạng:
-    {{
-        "queries": [
-            "truy vấn 1",
-            "truy vấn 2",
-            "truy vấn 3"
-        ]
-    }}
     """
     
     messages = [
         SystemMessage(content="Bạn là trợ lý hữu ích tạo ra các truy vấn tìm kiếm."),
-        HumanMessage(content=query_generation_prompt)
+        HumanMessage(content=planning_prompt)
     ]
     
-    response = llm.invoke(messages)
-    
-    # Extract queries from response
-    try:
-        content = response.content
-        # Extract JSON portion
-        if "```json" in content:
-            json_str = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_str = content.split("```")[1].split("```")[0].strip()
-        else:
-            json_str = content
-            
-        queries_data = json.loads(json_str)
-        return queries_data.get("queries", [])
-    except Exception as e:
-        print(f"Lỗi khi trích xuất truy vấn: {e}")
-        # Fallback to basic extraction
-        queries = []
-        for line in response.content.split("\n"):
-            if line.strip().startswith('"') or line.strip().startswith("'"):
-                queries.append(line.strip().strip('"\'').strip(','))
-        return queries[:5]  # Limit to 5 queries
-
-def perform_searches(queries, expert_name):
-    """Thực hiện tìm kiếm với các truy vấn được tạo."""
-    all_results = []
-    
+    result = await ainvoke_llm(llm, messages)
+    return result.queries
+
+async def perform_searches(queries, expert_name):
+    """Thực hiện song song các tìm kiếm với các truy vấn được tạo."""
     for i, query in enumerate(queries):
         print(f"[{expert_name}] Đang tìm kiếm ({i+1}/{len(queries)}): {query}")
-        try:
-            results = simple_search(query)
-            all_results.extend(results)
-            print(f"  Tìm thấy {len(results)} kết quả")
-        except Exception as e:
-            print(f"  Lỗi tìm kiếm: {e}")
+    
+    results_lists = await asyncio.gather(
+        *(asimple_search(query) for query in queries), return_exceptions=True
+    )
+    
+    all_results = []
+    for query, results in zip(queries, results_lists):
+        if isinstance(results, Exception):
+            print(f"  [{expert_name}] Lỗi tìm kiếm '{query}': {results}")
+            continue
+        all_results.extend(results)
+        print(f"  [{expert_name}] Tìm thấy {len(results)} kết quả cho '{query}'")
     
     return all_results
 
 def compile_search_results(results):
     """Biên soạn kết quả tìm kiếm thành văn bản định dạng."""
-    compiled = "KẾT QUẢ TÌM KIẾM:\n\n"
-    
-    for i, result in enumerate(results):
-        compiled += f"Kết quả {i+1}:\n"
-        compiled += f"Tiêu đề: {result.get('title', 'Không có tiêu đề')}\n"
-        compiled += f"Liên kết: {result.get('link', 'Không có liên kết')}\n"
-        compiled += f"Đoạn trích: {result.get('snippet', 'Không có đoạn trích')}\n\n"
+    parts = ["KẾT QUẢ TÌM KIẾM:\n\n"]
+    parts.extend(
+        f"Kết quả {i+1}:\n"
+        f"Tiêu đề: {result.get('title', 'Không có tiêu đề')}\n"
+        f"Liên kết: {result.get('link', 'Không có liên kết')}\n"
+        f"Đoạn trích: {result.get('snippet', 'Không có đoạn trích')}\n\n"
+        for i, result in enumerate(results)
+    )
     
-    return compiled
+    return "".join(parts)
 
-def analyze_results(llm, system_prompt, question, search_results, expert_name):
+async def analyze_results(llm, system_prompt, question, search_results, expert_name):
     """Tạo phân tích chuyên gia dựa trên kết quả tìm kiếm."""
     analysis_prompt = f"""
     {system_prompt}
@@ -177,24 +295,78 @@ def analyze_results(llm, system_prompt, question, search_results, expert_name):
         HumanMessage(content=analysis_prompt)
     ]
     
-    response = llm.invoke(messages)
+    response = await ainvoke_llm(llm, messages)
     return response.content
 
-def save_expert_analysis(expert_name, analysis, question, output_folder):
+EXPERT_DIR = "expert_responses"  # Subfolder for individual expert analyses
+GROUP_DIR = "group_responses"  # Subfolder for group summaries
+
+EXPERT_CACHE_DIR = Path(__file__).parent.parent / ".expert_cache"  # Expert results reused across runs
+EXPERT_CACHE_TTL = 24 * 60 * 60  # Seconds a cached expert result stays valid
+EXPERT_CACHE_KEYS = ("analysis", "queries", "results", "created_at")  # Fields every cache entry must have
+
+@lru_cache(maxsize=None)
+def ensure_dir(path: Path) -> Path:
+    """Tạo thư mục ở lần gọi đầu tiên và trả về đường dẫn."""
+    path.mkdir(exist_ok=True, parents=True)
+    return path
+
+def get_output_dir(output_folder: str, subfolder: str = "") -> Path:
+    """Trả về thư mục lưu kết quả; thư mục chỉ được tạo ở lần gọi đầu tiên."""
+    return ensure_dir(Path(__file__).parent / output_folder / subfolder)
+
+def expert_cache_path(agent_name: str, system_prompt: str, question: str) -> Path:
+    """
+    Đường dẫn tệp lưu đệm kết quả của một chuyên gia cho một câu hỏi.
+    Khóa gồm cả prompt và mô hình, nên sửa prompt hoặc đổi mô hình sẽ phân tích lại.
+    """
+    key_source = "\n".join([agent_name, system_prompt, MODEL_NAME, get_query_model_name(), question])
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+    return EXPERT_CACHE_DIR / f"{key}.json"
+
+async def load_expert_cache(cache_path: Path) -> Optional[Dict[str, Any]]:
+    """Đọc kết quả chuyên gia đã lưu đệm; trả về None nếu chưa có, đã hết hạn hoặc tệp bị hỏng."""
+    if not cache_path.exists():
+        return None
+    
+    try:
+        async with aiofiles.open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.loads(await f.read())
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Bỏ qua bộ nhớ đệm hỏng {cache_path}: {e}")
+        return None
+    
+    if not isinstance(cached, dict) or any(key not in cached for key in EXPERT_CACHE_KEYS):
+        print(f"Bỏ qua bộ nhớ đệm thiếu dữ liệu {cache_path}")
+        return None
+    if not isinstance(cached["created_at"], (int, float)) or time.time() - cached["created_at"] > EXPERT_CACHE_TTL:
+        return None
+    return cached
+
+async def save_expert_cache(cache_path: Path, data: Dict[str, Any]) -> None:
+    """Lưu đệm kết quả chuyên gia: ghi ra tệp tạm rồi đổi tên để tệp không bao giờ bị ghi dở."""
+    # Not memoized like ensure_dir: the cache directory may be removed while the process runs
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    
+    async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+        await f.write(json.dumps(data, ensure_ascii=False))
+    os.replace(tmp_path, cache_path)
+
+async def save_expert_analysis(expert_name, analysis, question, output_folder):
     """Lưu phân tích của chuyên gia vào tệp."""
-    output_dir = Path(__file__).parent / output_folder / "expert_responses"
-    output_dir.mkdir(exist_ok=True, parents=True)
+    output_dir = get_output_dir(output_folder, EXPERT_DIR)
     
-    with open(output_dir / f"{expert_name}.txt", 'w', encoding='utf-8') as f:
-        f.write(f"=== PHÂN TÍCH TỪ {expert_name.upper()} ===\n\n")
-        f.write(f"Câu hỏi: {question}\n\n")
-        f.write(analysis)
+    async with aiofiles.open(output_dir / f"{expert_name}.txt", 'w', encoding='utf-8') as f:
+        await f.write(f"=== PHÂN TÍCH TỪ {expert_name.upper()} ===\n\n")
+        await f.write(f"Câu hỏi: {question}\n\n")
+        await f.write(analysis)
     
     print(f"[{expert_name}] Phân tích đã được lưu vào {output_dir / f'{expert_name}.txt'}")
 
 def create_expert_agent(system_prompt: str, agent_name: str, group_key: str):
     """Tạo hàm agent chuyên gia để sử dụng như một node trong đồ thị."""
-    def expert_analysis(state: AgentState) -> Dict:
+    async def expert_analysis(state: AgentState) -> Dict:
         """Chạy phân tích chuyên gia và lưu trong state."""
         try:
             # Get values from state
@@ -203,23 +375,52 @@ def create_expert_agent(system_prompt: str, agent_name: str, group_key: str):
             
             print(f"\n[DEBUG] Đang chạy {agent_name} cho câu hỏi: {question}")
             
-            # Get LLM
+            # Reuse a previous successful run of this expert on the same question
+            cache_path = expert_cache_path(agent_name, system_prompt, question)
+            cached = await load_expert_cache(cache_path)
+            if cached is not None:
+                print(f"[{agent_name}] Dùng lại kết quả đã lưu đệm tại {cache_path}")
+                await save_expert_analysis(agent_name, cached["analysis"], question, output_folder)
+                return {
+                    group_key: {agent_name: cached["analysis"]},
+                    "search_results": {
+                        f"{agent_name}_search": {
+                            "queries": cached["queries"],
+                            "results": cached["results"]
+                        }
+                    }
+                }
+            
+            # Get LLMs: a smaller model is enough for planning the searches
             llm = get_model()
+            query_llm = get_small_model(SearchQueries)
             
             # Step 1: Generate search queries
-            queries = generate_search_queries(llm, system_prompt, question, agent_name)
+            queries = await generate_search_queries(query_llm, system_prompt, question, agent_name)
             
             # Step 2: Perform searches
-            search_results = perform_searches(queries, agent_name)
+            search_results = await perform_searches(queries, agent_name)
             
             # Step 3: Compile search results
             compiled_results = compile_search_results(search_results)
             
-            # Step 4: Analyze results
-            analysis = analyze_results(llm, system_prompt, question, compiled_results, agent_name)
+            # Step 4: Analyze results; the main model structures the report itself
+            analysis = await analyze_results(llm, system_prompt, question, compiled_results, agent_name)
             
-            # Step 5: Save analysis
-            save_expert_analysis(agent_name, analysis, question, output_folder)
+            # Step 5: Save analysis and cache it for later runs, unless no search succeeded:
+            # an analysis without search grounding should be redone once search works again
+            await save_expert_analysis(agent_name, analysis, question, output_folder)
+            if search_results:
+                try:
+                    await save_expert_cache(cache_path, {
+                        "analysis": analysis,
+                        "queries": queries,
+                        "results": search_results,
+                        "created_at": time.time()
+                    })
+                except Exception as e:
+                    # The analysis is done; failing to cache it only costs a rerun next time
+                    print(f"[{agent_name}] Không thể lưu đệm kết quả vào {cache_path}: {str(e)}")
             
             # Return the group-specific data
             return {
@@ -279,7 +480,7 @@ investment_psychology_node = create_expert_agent(INVESTMENT_PSYCHOLOGY_EXPERT, "
 
 def create_group_summarizer(group_name: str, expert_names: List[str], group_key: str):
     """Tạo một hàm tổng hợp nhóm để sử dụng như một node trong đồ thị."""
-    def summarize_group(state: AgentState) -> Dict:
+    async def summarize_group(state: AgentState) -> Dict:
         """Tổng hợp phân tích từ các chuyên gia trong nhóm."""
         try:
             # Extract analyses from experts in this group
@@ -338,19 +539,18 @@ def create_group_summarizer(group_name: str, expert_names: List[str], group_key:
                 HumanMessage(content=summary_prompt)
             ]
             
-            response = llm.invoke(messages)
+            response = await ainvoke_llm(llm, messages)
             summary = response.content
             
             # Save the summary
-            output_dir = Path(__file__).parent / output_folder / "group_responses"
-            output_dir.mkdir(exist_ok=True, parents=True)
+            output_dir = get_output_dir(output_folder, GROUP_DIR)
             
             clean_group_name = group_name.split("(")[0].strip() if "(" in group_name else group_name
             
-            with open(output_dir / f"{clean_group_name}.txt", 'w', encoding='utf-8') as f:
-                f.write(f"=== TÓM TẮT NHÓM: {clean_group_name.upper()} ===\n\n")
-                f.write(f"Câu hỏi: {question}\n\n")
-                f.write(summary)
+            async with aiofiles.open(output_dir / f"{clean_group_name}.txt", 'w', encoding='utf-8') as f:
+                await f.write(f"=== TÓM TẮT NHÓM: {clean_group_name.upper()} ===\n\n")
+                await f.write(f"Câu hỏi: {question}\n\n")
+                await f.write(summary)
             
             # Return only the group summaries
             return {
@@ -401,8 +601,8 @@ strategy_group_summarizer = create_group_summarizer(
     "group_5"
 )
 
-def final_synthesizer(state: AgentState) -> Dict:
-    """Tạo báo cáo chiến lược đầu tư cuối cùng."""
+async def final_synthesizer(state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+    """Tạo báo cáo chiến lược đầu tư cuối cùng, stream từng token qua custom stream của đồ thị."""
     try:
         # Format all group summaries
         group_summaries_text = ""
@@ -445,17 +645,15 @@ def final_synthesizer(state: AgentState) -> Dict:
             HumanMessage(content=synthesis_prompt)
         ]
         
-        response = llm.invoke(messages)
-        final_report = response.content
+        final_report = await astream_llm(llm, messages, writer, config)
         
         # Save the final report
-        output_dir = Path(__file__).parent / output_folder
-        output_dir.mkdir(exist_ok=True)
+        output_dir = get_output_dir(output_folder)
         
-        with open(output_dir / "final_investment_strategy.txt", 'w', encoding='utf-8') as f:
-            f.write("=== CHIẾN LƯỢC ĐẦU TƯ TỐI ƯU ===\n\n")
-            f.write(f"Câu hỏi: {question}\n\n")
-            f.write(final_report)
+        async with aiofiles.open(output_dir / "final_investment_strategy.txt", 'w', encoding='utf-8') as f:
+            await f.write("=== CHIẾN LƯỢC ĐẦU TƯ TỐI ƯU ===\n\n")
+            await f.write(f"Câu hỏi: {question}\n\n")
+            await f.write(final_report)
         
         print(f"Chiến lược đầu tư cuối cùng đã được lưu vào {output_dir / 'final_investment_strategy.txt'}")
         
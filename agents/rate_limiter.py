@@ -0,0 +1,90 @@
+from typing import Deque, List, Tuple
+import time
+import asyncio
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+
+from langchain_core.messages import BaseMessage
+
+WINDOW_SECONDS = 60.0  # Length of the sliding window for the RPM/TPM budgets
+CHARS_PER_TOKEN = 4  # Rough characters-per-token ratio used to estimate prompt size
+COMPLETION_TOKENS = 1500  # Tokens reserved for the completion of each request
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """
+    Ước lượng số token của một lời gọi LLM (prompt và phần trả lời).
+
+    Args:
+        messages: Danh sách tin nhắn gửi tới mô hình
+
+    Returns:
+        Số token ước lượng
+    """
+    prompt_chars = sum(len(str(message.content)) for message in messages)
+    return prompt_chars // CHARS_PER_TOKEN + COMPLETION_TOKENS
+
+class LLMRateLimiter:
+    """
+    Giới hạn số lời gọi LLM đồng thời và ngân sách request/token mỗi phút.
+    Semaphore và lock được tạo riêng cho từng event loop, nên có thể dùng lại bộ giới hạn
+    qua nhiều lần asyncio.run trong cùng tiến trình; ngân sách mỗi phút vẫn dùng chung.
+
+    Args:
+        max_concurrency: Số lời gọi tối đa chạy cùng lúc
+        rpm: Số request tối đa mỗi phút
+        tpm: Số token tối đa mỗi phút
+    """
+    def __init__(self, max_concurrency: int, rpm: int, tpm: int):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        # asyncio primitives are bound to the loop they are first used on
+        self._primitives: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[asyncio.Semaphore, asyncio.Lock]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._window: Deque[Tuple[float, int]] = deque()
+        self._window_tokens = 0
+
+    def _loop_primitives(self) -> Tuple[asyncio.Semaphore, asyncio.Lock]:
+        """Lấy (tạo nếu chưa có) semaphore và lock của event loop đang chạy."""
+        loop = asyncio.get_running_loop()
+        primitives = self._primitives.get(loop)
+        if primitives is None:
+            primitives = (asyncio.Semaphore(self.max_concurrency), asyncio.Lock())
+            self._primitives[loop] = primitives
+        return primitives
+
+    def _prune(self, now: float) -> None:
+        """Bỏ các request đã ra khỏi cửa sổ trượt."""
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    async def _reserve(self, estimated_tokens: int) -> None:
+        """Chờ tới khi cửa sổ hiện tại còn đủ ngân sách rồi ghi nhận request."""
+        # A single request larger than the whole budget must still be able to run
+        tokens = min(estimated_tokens, self.tpm)
+        _, lock = self._loop_primitives()
+        async with lock:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                if len(self._window) < self.rpm and self._window_tokens + tokens <= self.tpm:
+                    self._window.append((now, tokens))
+                    self._window_tokens += tokens
+                    return
+                await asyncio.sleep(self._window[0][0] + WINDOW_SECONDS - now)
+
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens: int = 0):
+        """
+        Giữ một suất gọi LLM trong suốt khối `async with`.
+
+        Args:
+            estimated_tokens: Số token ước lượng của lời gọi
+        """
+        semaphore, _ = self._loop_primitives()
+        async with semaphore:
+            await self._reserve(estimated_tokens)
+            yield
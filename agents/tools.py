@@ -1,8 +1,13 @@
-from typing import List, Dict, Optional, Any
-import os
+from typing import List, Dict, Tuple
 import time
+import asyncio
 import random
-from datetime import datetime
+import threading
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from diskcache import Cache
 from langchain_community.utilities.duckduckgo_search import DuckDuckGoSearchAPIWrapper
 
 # Initialize DuckDuckGo search
@@ -11,19 +16,47 @@ DEFAULT_MAX_RESULTS = 5
 MAX_RETRIES = 3  # Maximum number of retries for search
 BASE_DELAY = 1  # Base delay in seconds before retrying
 JITTER = 0.5  # Random jitter to add to retry timing
+MAX_CONCURRENT_SEARCHES = 4  # Maximum number of searches in flight at once
+SEARCH_CACHE_SIZE = 1024  # Maximum number of queries kept in the in-process cache
+SEARCH_CACHE_TTL = 24 * 60 * 60  # Seconds a search result stays cached, in memory and on disk
+SEARCH_CACHE_DIR = Path(__file__).parent.parent / ".search_cache"
 
-def simple_search(query: str) -> List[Dict[str, str]]:
-    """
-    Thực hiện tìm kiếm đơn giản sử dụng DuckDuckGo với cơ chế thử lại để tránh RateLimit.
-    
-    Args:
-        query: Truy vấn tìm kiếm
-        
-    Returns:
-        Danh sách kết quả tìm kiếm với title, link, và snippet
-    """
+# In-process cache in front of the on-disk one, keyed by normalized query;
+# each entry holds the time it expires at and the results
+memory_search_cache: "OrderedDict[str, Tuple[float, Tuple[Dict[str, str], ...]]]" = OrderedDict()
+memory_search_cache_lock = threading.Lock()
+
+# Bound concurrent searches across all experts to stay under DuckDuckGo rate limits;
+# semaphores are bound to an event loop, so each running loop gets its own
+search_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+# Searches currently running on each loop, keyed by normalized query, so concurrent experts share one request
+inflight_searches: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task[List[Dict[str, str]]]]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+@lru_cache(maxsize=1)
+def get_search_cache() -> Cache:
+    """Mở (ở lần gọi đầu tiên) bộ nhớ đệm trên đĩa dùng chung giữa các lần chạy."""
+    return Cache(str(SEARCH_CACHE_DIR))
+
+def get_search_semaphore() -> asyncio.Semaphore:
+    """Lấy (tạo nếu chưa có) semaphore giới hạn tìm kiếm của event loop đang chạy."""
+    loop = asyncio.get_running_loop()
+    semaphore = search_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+        search_semaphores[loop] = semaphore
+    return semaphore
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hóa truy vấn (chữ thường, gộp khoảng trắng) để làm khóa bộ nhớ đệm."""
+    return " ".join(query.lower().split())
+
+def _search_with_retries(query: str) -> List[Dict[str, str]]:
+    """Gọi DuckDuckGo với cơ chế thử lại, ném lỗi cuối cùng nếu vẫn thất bại."""
     retries = 0
-    while retries <= MAX_RETRIES:
+    while True:
         try:
             results = search_api.results(query, max_results=DEFAULT_MAX_RESULTS)
             
@@ -40,14 +73,90 @@ def simple_search(query: str) -> List[Dict[str, str]]:
         except Exception as e:
             retries += 1
             if retries > MAX_RETRIES:
-                print(f"Đã đạt đến số lần thử lại tối đa. Lỗi tìm kiếm cuối cùng: {str(e)}")
-                return []
+                raise
             
             # Calculate delay with linear backoff (not exponential as requested) and jitter
             delay = BASE_DELAY * retries + random.uniform(0, JITTER)
             print(f"Lỗi tìm kiếm: {str(e)}. Thử lại sau {delay:.2f} giây... (lần thử {retries}/{MAX_RETRIES})")
             time.sleep(delay)
 
+def _cached_search(query: str) -> Tuple[Dict[str, str], ...]:
+    """
+    Tra bộ nhớ đệm trong tiến trình rồi trên đĩa trước khi gọi API; lỗi tìm kiếm không được lưu đệm.
+    Chỉ khóa đệm được chuẩn hóa, truy vấn gửi tới API vẫn giữ nguyên.
+    """
+    key = normalize_query(query)
+    with memory_search_cache_lock:
+        entry = memory_search_cache.get(key)
+        if entry is not None:
+            expires_at, results = entry
+            if time.time() < expires_at:
+                memory_search_cache.move_to_end(key)
+                return results
+            del memory_search_cache[key]
+    
+    # Keep the on-disk expiry so a result loaded from disk does not outlive it in memory
+    search_cache = get_search_cache()
+    results, expires_at = search_cache.get(key, expire_time=True)
+    if results is None:
+        results = _search_with_retries(query)
+        expires_at = time.time() + SEARCH_CACHE_TTL
+        search_cache.set(key, results, expire=SEARCH_CACHE_TTL)
+    results = tuple(results)
+    
+    with memory_search_cache_lock:
+        memory_search_cache[key] = (expires_at, results)
+        memory_search_cache.move_to_end(key)
+        if len(memory_search_cache) > SEARCH_CACHE_SIZE:
+            memory_search_cache.popitem(last=False)
+    return results
+
+def simple_search(query: str) -> List[Dict[str, str]]:
+    """
+    Thực hiện tìm kiếm đơn giản sử dụng DuckDuckGo với cơ chế thử lại để tránh RateLimit.
+    Kết quả được lưu đệm trong bộ nhớ và trên đĩa theo truy vấn đã chuẩn hóa.
+    
+    Args:
+        query: Truy vấn tìm kiếm
+        
+    Returns:
+        Danh sách kết quả tìm kiếm với title, link, và snippet
+    """
+    try:
+        # Copy the cached results so callers cannot mutate the shared cache entries
+        return [dict(result) for result in _cached_search(query)]
+    except Exception as e:
+        print(f"Đã đạt đến số lần thử lại tối đa. Lỗi tìm kiếm cuối cùng: {str(e)}")
+        return []
+
+async def _run_search(query: str) -> List[Dict[str, str]]:
+    """Chạy simple_search trong luồng riêng, giới hạn số tìm kiếm đồng thời."""
+    async with get_search_semaphore():
+        return await asyncio.to_thread(simple_search, query)
+
+async def asimple_search(query: str) -> List[Dict[str, str]]:
+    """
+    Phiên bản bất đồng bộ của simple_search, chạy client tìm kiếm trong luồng riêng.
+    Các lời gọi trùng truy vấn (đã chuẩn hóa) trong lúc tìm kiếm đang chạy sẽ chờ chung một kết quả.
+    
+    Args:
+        query: Truy vấn tìm kiếm
+        
+    Returns:
+        Danh sách kết quả tìm kiếm với title, link, và snippet
+    """
+    key = normalize_query(query)
+    loop_searches = inflight_searches.setdefault(asyncio.get_running_loop(), {})
+    task = loop_searches.get(key)
+    if task is None:
+        task = asyncio.create_task(_run_search(query))
+        loop_searches[key] = task
+        task.add_done_callback(lambda _: loop_searches.pop(key, None))
+    
+    # Shield the shared task so one cancelled caller does not cancel it for the others
+    results = await asyncio.shield(task)
+    return [dict(result) for result in results]
+
 def search_with_context(query: str, context: str) -> List[Dict[str, str]]:
     """
     Thực hiện tìm kiếm với ngữ cảnh bổ sung.
@@ -1,16 +1,13 @@
-import os
 import sys
-import locale
+import asyncio
 import io
-from typing import Dict, List, Any
+from typing import Dict, Any
 from pathlib import Path
-from dotenv import load_dotenv
 import logging
 from datetime import datetime
 
 sys.path.append(str(Path(__file__).parent))
 
-from agents.nodes import AgentState
 from agents.groups import main_graph
 
 # Force UTF-8 encoding for stdout
@@ -28,8 +25,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger("investment_analysis")
 
-# Load environment variables
-load_dotenv()
+async def run_analysis(initial_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Chạy đồ thị phân tích và in báo cáo cuối cùng ngay khi từng token được tạo ra."""
+    result = {}
+    streamed_parts = []
+    
+    # Only the final synthesis streams its tokens (through the custom stream), other LLM calls do not
+    async for mode, chunk in main_graph.astream(initial_state, stream_mode=["custom", "values"]):
+        if mode == "values":
+            result = chunk
+            continue
+        
+        if "final_report_token" in chunk:
+            if not streamed_parts:
+                print("\n=== INVESTMENT STRATEGY ===\n")
+            streamed_parts.append(chunk["final_report_token"])
+            print(chunk["final_report_token"], end="", flush=True)
+    
+    # Print the full report if it is not what was streamed: nothing was streamed,
+    # or the stream broke off and the synthesis returned an error instead
+    final_report = result.get("final_report", "")
+    if not streamed_parts:
+        print("\n=== INVESTMENT STRATEGY ===\n")
+        print(final_report)
+    elif final_report != "".join(streamed_parts):
+        print("\n")
+        print(final_report)
+    else:
+        print()
+    
+    return result
 
 def main():
     """Entry point for the investment strategy optimization system."""
@@ -75,17 +100,13 @@ def main():
     # Run analysis with LangGraph
     logger.info("Calling analysis graph for question")
     start_time = datetime.now()
-    result = main_graph.invoke(initial_state)
+    asyncio.run(run_analysis(initial_state))
     end_time = datetime.now()
     
     # Log execution time
     duration = (end_time - start_time).total_seconds()
     logger.info(f"Analysis completed in {duration:.2f} seconds")
     
-    # Print final investment strategy to console
-    print("\n=== INVESTMENT STRATEGY ===\n")
-    print(result["final_report"])
-    
     logger.info("Analysis complete.")
 
 if __name__ == "__main__":